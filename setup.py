@@ -48,6 +48,8 @@ tests_require = [
 
 yubikey_require = ["yubikey-manager==5.1.*"]
 
+speedups_require = ["orjson>=3.8"]
+
 # Determine the appropriate version of pygit2 based on the Python version
 if sys.version_info > (3, 10):
     pygit2_version = "pygit2==1.14.1"
@@ -86,6 +88,7 @@ kwargs = {
         "test": tests_require,
         "dev": dev_require,
         "yubikey": yubikey_require,
+        "speedups": speedups_require,
     },
     "tests_require": tests_require,
     "entry_points": {
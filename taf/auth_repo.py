@@ -1,13 +1,16 @@
+import copy
 import json
 import os
 import tempfile
+import threading
 import fnmatch
 
-from typing import Any, Callable, Dict, List, Optional, Union
-from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
 from pathlib import Path
-from tuf.repository_tool import METADATA_DIRECTORY_NAME
+from tuf.repository_tool import METADATA_DIRECTORY_NAME, TARGETS_DIRECTORY_NAME
+from taf.exceptions import GitError
 from taf.git import GitRepository
 from taf.repository_tool import (
     Repository as TAFRepository,
@@ -15,6 +18,33 @@ from taf.repository_tool import (
     get_target_path,
 )
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads  # type: ignore
+
+
+class _ExcludedTargets:
+    """
+    Matches target paths against excluded globs, remembering the result for
+    each path, since the same targets are checked for every commit
+    """
+
+    def __init__(self, excluded_target_globs: Optional[List[str]]):
+        self.excluded_target_globs = excluded_target_globs or []
+        self._excluded: Dict[str, bool] = {}
+
+    def is_excluded(self, target_path: str) -> bool:
+        excluded = self._excluded.get(target_path)
+        if excluded is None:
+            excluded = self._excluded[target_path] = any(
+                fnmatch.fnmatch(target_path, excluded_target_glob)
+                for excluded_target_glob in self.excluded_target_globs
+            )
+        return excluded
+
 
 class AuthenticationRepository(GitRepository, TAFRepository):
 
@@ -74,6 +104,9 @@ class AuthenticationRepository(GitRepository, TAFRepository):
 
         self.conf_directory_root = conf_directory_root_path.resolve()
         self.out_of_band_authentication = out_of_band_authentication
+        # parsed json files, keyed by their blob ids
+        self._json_blob_cache: Dict[str, Any] = {}
+        self._role_target_paths_cache: Dict[str, Optional[List[str]]] = {}
 
     # TODO rework conf_dir
 
@@ -149,6 +182,80 @@ class AuthenticationRepository(GitRepository, TAFRepository):
             return f"{self.alias}: "
         return f"Auth repo {self.name}: "
 
+    def _parse_json_blob(self, blob: Optional[bytes]) -> Optional[Dict]:
+        if blob is None:
+            return None
+        try:
+            return _loads(blob)
+        # orjson.JSONDecodeError is a subclass of json.decoder.JSONDecodeError
+        except json.decoder.JSONDecodeError:
+            pass
+        try:
+            # orjson is stricter than json and rejects e.g. NaN and Infinity
+            return json.loads(blob)
+        except json.decoder.JSONDecodeError:
+            return None
+
+    def _load_json_blobs(self, blob_shas: Iterable[str]) -> None:
+        """
+        Read and parse all blobs which are not already cached, requesting them
+        from the batched cat-file process at once
+        """
+        missing_blob_shas = [
+            blob_sha
+            for blob_sha in set(blob_shas)
+            if blob_sha not in self._json_blob_cache
+        ]
+        for blob_sha, blob in self._get_blobs(missing_blob_shas).items():
+            self._json_blob_cache[blob_sha] = self._parse_json_blob(blob)
+
+    def _get_json_blob(
+        self, commit: str, path: str, blob_sha: Optional[str]
+    ) -> Optional[Dict]:
+        """
+        Read and parse a json file at the given revision through the batched
+        cat-file process. Return None if the file does not exist or is not
+        a valid json. Parsed content is cached by blob id, so files which are
+        not modified between commits are only parsed once. The returned
+        dictionary is shared and must not be modified. Blob id is None if
+        the file does not exist at the given revision.
+        """
+        if blob_sha is None:
+            self._log_debug(f"{path} not available at revision {commit}")
+            return None
+        if blob_sha not in self._json_blob_cache:
+            self._json_blob_cache[blob_sha] = self._parse_json_blob(
+                self._get_blob(commit, path)
+            )
+        json_data = self._json_blob_cache[blob_sha]
+        if json_data is None:
+            self._log_debug(f"{path} not a valid json at revision {commit}")
+        return json_data
+
+    def _get_role_target_paths(
+        self, commit: str, role_name: str, blob_sha: Optional[str]
+    ) -> Optional[List[str]]:
+        """
+        Return paths of all targets listed in the role's metadata file at the given
+        revision, or None if the file does not exist or is not a valid json.
+        Targets metadata can list thousands of targets together with their hashes,
+        while only their paths are needed, so only the paths are cached by blob id
+        and the rest of the parsed metadata is released immediately.
+        """
+        metadata_path = get_role_metadata_path(role_name)
+        if blob_sha is None:
+            self._log_debug(f"{metadata_path} not available at revision {commit}")
+            return None
+        if blob_sha not in self._role_target_paths_cache:
+            metadata = self._parse_json_blob(self._get_blob(commit, metadata_path))
+            self._role_target_paths_cache[blob_sha] = (
+                list(metadata["signed"]["targets"]) if metadata is not None else None
+            )
+        target_paths = self._role_target_paths_cache[blob_sha]
+        if target_paths is None:
+            self._log_debug(f"{metadata_path} not a valid json at revision {commit}")
+        return target_paths
+
     def get_target(self, target_name, commit=None, safely=True) -> Optional[Dict]:
         if commit is None:
             commit = self.head_commit_sha()
@@ -247,13 +354,10 @@ class AuthenticationRepository(GitRepository, TAFRepository):
         targets = self.targets_at_revisions(
             *commits, target_repos=target_repos, default_branch=default_branch
         )
-        excluded_target_globs = excluded_target_globs or []
+        excluded_targets = _ExcludedTargets(excluded_target_globs)
         for commit in commits:
             for target_path, target_data in targets[commit].items():
-                if any(
-                    fnmatch.fnmatch(target_path, excluded_target_glob)
-                    for excluded_target_glob in excluded_target_globs
-                ):
+                if excluded_targets.is_excluded(target_path):
                     continue
 
                 target_branch = target_data.get("branch")
@@ -268,8 +372,8 @@ class AuthenticationRepository(GitRepository, TAFRepository):
                     "custom": target_data.get("custom"),
                 }
 
-        self._log_debug(
-            f"new commits per repositories according to target files: {repositories_commits}"
+        self._log_debug_lazy(
+            lambda: f"new commits per repositories according to target files: {repositories_commits}"
         )
         return repositories_commits
 
@@ -307,22 +411,22 @@ class AuthenticationRepository(GitRepository, TAFRepository):
         Keep in mind that targets metadata
         file is not updated everytime something is committed to the authentication repo.
         """
-        repositories_commits: Dict = defaultdict(dict)
         targets = self.targets_at_revisions(
             *commits, target_repos=target_repos, default_branch=default_branch
         )
+        excluded_targets = _ExcludedTargets(excluded_target_globs)
+        # every repository which is not excluded has at least one commit,
+        # so all of them can be added upfront, in order of their first appearance
+        repositories_commits: Dict = {
+            target_path: {}
+            for commit in commits
+            for target_path in targets[commit]
+            if not excluded_targets.is_excluded(target_path)
+        }
         previous_commits: Dict = {}
-        skipped_targets = []
-        excluded_target_globs = excluded_target_globs or []
         for commit in commits:
             for target_path, target_data in targets[commit].items():
-                if target_path in skipped_targets:
-                    continue
-                if any(
-                    fnmatch.fnmatch(target_path, excluded_target_glob)
-                    for excluded_target_glob in excluded_target_globs
-                ):
-                    skipped_targets.append(target_path)
+                if target_path not in repositories_commits:
                     continue
                 target_branch = target_data.get("branch")
                 target_commit = target_data.get("commit")
@@ -347,28 +451,64 @@ class AuthenticationRepository(GitRepository, TAFRepository):
                         }
                     )
                 previous_commits[target_path] = (target_commit, target_branch)
-        self._log_debug(
-            f"new commits per repositories according to target files: {repositories_commits}"
+        self._log_debug_lazy(
+            lambda: f"new commits per repositories according to target files: {repositories_commits}"
         )
         return repositories_commits
 
     def targets_at_revisions(self, *commits, target_repos=None, default_branch=None):
-        targets = defaultdict(dict)
         if default_branch is None:
             default_branch = self.default_branch
-        previous_metadata = []
+        # ids of threads which read files through cat-file processes, so that the
+        # processes are only kept running while the commits are read
+        thread_ids = {threading.get_ident()}
+        try:
+            return self._read_targets_at_revisions(
+                commits, target_repos, default_branch, thread_ids
+            )
+        finally:
+            self._close_cat_file(thread_ids)
+
+    def _read_targets_at_revisions(
+        self,
+        commits: Tuple[str, ...],
+        target_repos: Optional[List[str]],
+        default_branch: str,
+        thread_ids: Set[int],
+    ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Read data of all target repositories at the given revisions. Ids of threads
+        which start cat-file processes are added to thread_ids.
+        """
+        previous_metadata = {}
         new_files = []
+        # determining roles requires loading the TUF repository, which is not thread safe,
+        # so do that first and then read targets of all commits in parallel
+        commits_data = []
+        # commits whose target files and targets metadata are the same as those of
+        # the previous commit, mapped to the commit whose targets should be copied
+        unchanged_commits = {}
+        previous_commit = previous_inputs = None
         for commit in commits:
+            # ids of all target files, so that they can be read in one go
+            try:
+                target_blobs = self.list_blobs_at_revision(
+                    commit, TARGETS_DIRECTORY_NAME
+                )
+            except GitError:
+                target_blobs = {}
             # repositories.json might not exit, if the current commit is
             # the initial commit
-            repositories_at_revision = self.safely_get_json(
-                commit, get_target_path("repositories.json")
+            repositories_at_revision = self._get_json_blob(
+                commit,
+                get_target_path("repositories.json"),
+                target_blobs.get("repositories.json"),
             )
             if repositories_at_revision is None:
                 continue
             repositories_at_revision = repositories_at_revision["repositories"]
 
-            current_metadata = self.list_files_at_revision(
+            current_metadata = self.list_blobs_at_revision(
                 commit, METADATA_DIRECTORY_NAME
             )
             new_files = [
@@ -381,32 +521,112 @@ class AuthenticationRepository(GitRepository, TAFRepository):
                 with self.repository_at_revision(commit):
                     roles_at_revision = self.get_all_targets_roles()
 
-            for role_name in roles_at_revision:
-                # targets metadata files corresponding to the found roles must exist
-                targets_at_revision = self.safely_get_json(
-                    commit, get_role_metadata_path(role_name)
+            roles_blobs = {
+                role_name: current_metadata.get(f"{role_name}.json")
+                for role_name in roles_at_revision
+            }
+            inputs = (target_blobs, roles_blobs)
+            if inputs == previous_inputs:
+                unchanged_commits[commit] = previous_commit
+                continue
+            previous_commit, previous_inputs = commit, inputs
+            commits_data.append(
+                (commit, repositories_at_revision, roles_blobs, target_blobs)
+            )
+
+        # commits without repositories.json map to an empty dictionary
+        targets = {commit: {} for commit in commits}
+        if len(commits_data) <= 1:
+            # starting a thread pool and a cat-file process per worker thread
+            # is slower than reading a single commit directly
+            for commit, *data in commits_data:
+                targets[commit] = self._targets_at_revision(
+                    commit, *data, target_repos, default_branch
                 )
-                if targets_at_revision is None:
+        else:
+            # worker threads are registered as soon as they start, so that their
+            # cat-file processes are closed even if one of the tasks fails
+            with ThreadPoolExecutor(
+                initializer=lambda: thread_ids.add(threading.get_ident())
+            ) as executor:
+                future_to_commit = {
+                    executor.submit(
+                        self._targets_at_revision,
+                        commit,
+                        *data,
+                        target_repos,
+                        default_branch,
+                    ): commit
+                    for commit, *data in commits_data
+                }
+                for future in as_completed(future_to_commit):
+                    targets[future_to_commit[future]] = future.result()
+
+        for commit, previous_commit in unchanged_commits.items():
+            # callers update custom data of each commit, so it cannot be shared
+            targets[commit] = {
+                target_path: dict(
+                    target_data, custom=copy.deepcopy(target_data["custom"])
+                )
+                for target_path, target_data in targets[previous_commit].items()
+            }
+        return targets
+
+    def _targets_at_revision(
+        self,
+        commit: str,
+        repositories_at_revision: Dict,
+        roles_blobs: Dict[str, Optional[str]],
+        target_blobs: Dict[str, str],
+        target_repos: Optional[List[str]],
+        default_branch: str,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Read data of all target repositories at the given revision
+        """
+        target_paths = []
+        for role_name, role_blob_sha in roles_blobs.items():
+            # targets metadata files corresponding to the found roles must exist
+            role_target_paths = self._get_role_target_paths(
+                commit, role_name, role_blob_sha
+            )
+            if role_target_paths is None:
+                continue
+
+            for target_path in role_target_paths:
+                if target_path not in repositories_at_revision:
+                    # we only care about repositories
                     continue
-                targets_at_revision = targets_at_revision["signed"]["targets"]
-
-                for target_path in targets_at_revision:
-                    if target_path not in repositories_at_revision:
-                        # we only care about repositories
-                        continue
-                    if target_repos is not None and target_path not in target_repos:
-                        # if specific target repositories are specified, skip all other
-                        # repositories
-                        continue
-                    target_content = self.safely_get_json(
-                        commit, get_target_path(target_path)
+                if target_repos is not None and target_path not in target_repos:
+                    # if specific target repositories are specified, skip all other
+                    # repositories
+                    continue
+                if target_path not in target_blobs:
+                    self._log_debug(
+                        f"{get_target_path(target_path)} not available at revision {commit}"
                     )
-                    if target_content is not None:
-                        target_commit = target_content.pop("commit")
-                        target_branch = target_content.pop("branch", default_branch)
-                        targets[commit][target_path] = {
-                            "branch": target_branch,
-                            "commit": target_commit,
-                            "custom": target_content,
-                        }
+                    continue
+                target_paths.append(target_path)
+
+        self._load_json_blobs(target_blobs[target_path] for target_path in target_paths)
+        targets: Dict[str, Dict[str, Any]] = {}
+        for target_path in target_paths:
+            target_content = self._json_blob_cache[target_blobs[target_path]]
+            if target_content is None:
+                self._log_debug(
+                    f"{get_target_path(target_path)} not a valid json at revision {commit}"
+                )
+                continue
+            # target_content is cached, so copy it instead of popping keys
+            target_commit = target_content["commit"]
+            target_branch = target_content.get("branch", default_branch)
+            targets[target_path] = {
+                "branch": target_branch,
+                "commit": target_commit,
+                "custom": {
+                    key: copy.deepcopy(value)
+                    for key, value in target_content.items()
+                    if key not in ("commit", "branch")
+                },
+            }
         return targets
@@ -8,6 +8,7 @@ import uuid
 import pygit2
 import subprocess
 import logging
+import threading
 from collections import OrderedDict
 from functools import reduce
 from pathlib import Path
@@ -23,7 +24,7 @@ from taf.exceptions import (
 )
 from taf.log import taf_logger
 from taf.utils import run
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 from .pygit import PyGitRepository
 
 EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
@@ -100,6 +101,12 @@ class GitRepository:
             default_branch = self._determine_default_branch()
         self.default_branch = default_branch
 
+    def __del__(self):
+        # closing stdin makes git exit, but do not wait for it during garbage collection
+        for process in (self._cat_file_processes or {}).values():
+            process.stdin.close()  # type: ignore
+            process.stdout.close()  # type: ignore
+
     _pygit = None
 
     @property
@@ -111,6 +118,116 @@ class GitRepository:
                 pass
         return self._pygit
 
+    _cat_file_processes: Optional[Dict[int, subprocess.Popen]] = None
+
+    def _cat_file(self) -> subprocess.Popen:
+        """
+        Long-running `git cat-file --batch` process, used to read objects
+        without spawning a new git process for every file.
+        Every thread gets its own process, so that requests and responses of
+        different threads cannot interleave.
+        """
+        if self._cat_file_processes is None:
+            self._cat_file_processes = {}
+        thread_id = threading.get_ident()
+        process = self._cat_file_processes.get(thread_id)
+        if process is None or process.poll() is not None:
+            command = ["git", "-C", str(self.path)]
+            if self.allow_unsafe:
+                command.extend(["-c", f"safe.directory={self.path}"])
+            command.extend(["cat-file", "--batch"])
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            self._cat_file_processes[thread_id] = process
+        return process
+
+    def _close_cat_file(self, thread_ids: Optional[Set[int]] = None) -> None:
+        """
+        Stop cat-file processes started by the given threads, or all of them
+        if thread ids are not specified
+        """
+        processes = self._cat_file_processes
+        if not processes:
+            return
+        for thread_id in list(processes):
+            if thread_ids is not None and thread_id not in thread_ids:
+                continue
+            process = processes.pop(thread_id)
+            try:
+                process.stdin.close()  # type: ignore
+                process.wait()
+            finally:
+                process.stdout.close()  # type: ignore
+
+    def _query_cat_file(self, revisions: List[str]) -> Optional[subprocess.Popen]:
+        """
+        Send the given revisions to the cat-file process, one per line, and return
+        the process whose output should then be read. Return None if git exited.
+        """
+        process = self._cat_file()
+        try:
+            process.stdin.write(  # type: ignore
+                "".join(f"{revision}\n" for revision in revisions).encode()
+            )
+            process.stdin.flush()  # type: ignore
+        except BrokenPipeError:
+            # git exited, e.g. if the repository does not exist
+            self._close_cat_file({threading.get_ident()})
+            return None
+        return process
+
+    def _read_cat_file_blob(self, process: subprocess.Popen) -> Optional[bytes]:
+        """
+        Read a single response of the batched cat-file process. Return None if the
+        requested object does not exist or is not a blob.
+        """
+        header = process.stdout.readline().split()  # type: ignore
+        # missing objects are reported as "<object> missing", where the object
+        # name can contain spaces, so check the last field instead of counting them
+        if not header or header[-1] in (b"missing", b"ambiguous"):
+            return None
+        _, object_type, size = header
+        # content is followed by a newline
+        content = process.stdout.read(int(size) + 1)[:-1]  # type: ignore
+        if object_type != b"blob":
+            return None
+        return content
+
+    def _get_blob(self, commit: str, path: str) -> Optional[bytes]:
+        """
+        Read content of the blob at the given path and revision using the
+        batched cat-file process. Return None if the object does not exist
+        or is not a blob.
+        """
+        process = self._query_cat_file([f"{commit}:{Path(path).as_posix()}"])
+        if process is None:
+            return None
+        return self._read_cat_file_blob(process)
+
+    # number of objects requested at once, small enough for the requests to fit
+    # into the pipe's buffer, so that writing them cannot block while git waits
+    # for its output to be read
+    _CAT_FILE_CHUNK_SIZE = 100
+
+    def _get_blobs(self, blob_shas: List[str]) -> Dict[str, Optional[bytes]]:
+        """
+        Read content of multiple blobs, requesting them from the batched
+        cat-file process in chunks instead of one by one
+        """
+        blobs: Dict[str, Optional[bytes]] = {}
+        for start in range(0, len(blob_shas), self._CAT_FILE_CHUNK_SIZE):
+            chunk = blob_shas[start : start + self._CAT_FILE_CHUNK_SIZE]
+            process = self._query_cat_file(chunk)
+            for blob_sha in chunk:
+                blobs[blob_sha] = (
+                    self._read_cat_file_blob(process) if process is not None else None
+                )
+        return blobs
+
     @classmethod
     def from_json_dict(cls, json_data: Dict):
         """Create a new instance based on data contained by the `json_data` dictionary,
@@ -270,6 +387,12 @@ class GitRepository:
     def _log_debug(self, message: str) -> None:
         self._log(self.logging_functions[logging.DEBUG], message)
 
+    def _log_debug_lazy(self, message_func: Callable[[], str]) -> None:
+        """Log a debug message which is only built if debug messages are emitted"""
+        taf_logger.opt(lazy=True).debug(
+            self.log_template, lambda: self.log_prefix, message_func
+        )
+
     def _log_info(self, message: str) -> None:
         self._log(self.logging_functions[logging.INFO], message)
 
@@ -584,6 +707,7 @@ class GitRepository:
         self._git("clean -fd")
 
     def cleanup(self):
+        self._close_cat_file()
         if self._pygit is not None:
             self._pygit.cleanup()
             self._pygit = None
@@ -1205,6 +1329,38 @@ class GitRepository:
             )
             return self._list_files_at_revision(commit, posix_path)
 
+    def list_blobs_at_revision(self, commit: str, path: str = "") -> Dict[str, str]:
+        """
+        Return a dictionary mapping paths of all files inside the given directory,
+        relative to that directory, to their blob ids
+        """
+        posix_path = Path(path).as_posix()
+        try:
+            return self.pygit.list_blobs_at_revision(commit, posix_path)
+        except TAFError as e:
+            raise e
+        except Exception:
+            self._log_warning(
+                "Perfomance regression: Could not list files with pygit2. Reverting to git subprocess"
+            )
+            return self._list_blobs_at_revision(commit, posix_path)
+
+    def _list_blobs_at_revision(self, commit: str, path: str) -> Dict[str, str]:
+        entries = self._git("ls-tree -r -z {} -- {}", commit, path)
+        blobs: Dict[str, str] = {}
+        if not entries:
+            return blobs
+        prefix = f"{path.rstrip('/')}/" if path else ""
+        for entry in entries.split("\0"):
+            if not entry:
+                continue
+            # entries are in the "<mode> <type> <object>\t<path>" format
+            info, file_path = entry.split("\t", 1)
+            _, object_type, blob_sha = info.split()
+            if object_type == "blob" and file_path.startswith(prefix):
+                blobs[file_path[len(prefix) :]] = blob_sha
+        return blobs
+
     def _list_files_at_revision(self, commit: str, path: str) -> List[str]:
         if path is None:
             path = ""
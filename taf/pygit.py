@@ -86,26 +86,52 @@ class PyGitRepository:
                 self._files_cache[git_id] |= {type: content}
             return git_id, self._files_cache[git_id][type]
 
-    def _list_files_at_revision(self, tree, path="", results=None):
+    def _walk_blobs(self, tree, path=""):
         """
-        recurse through tree and return paths relative to that tree for
-        all blobs in that tree.
+        recurse through tree and yield paths relative to that tree, separated
+        by forward slashes, together with entries of all blobs in that tree.
         """
-        if results is None:
-            results = []
-
         for entry in tree:
-            new_path = os.path.join(path, entry.name)
+            new_path = f"{path}/{entry.name}" if path else entry.name
             if entry.type_str == "blob":
-                results.append(new_path)
+                yield new_path, entry
             elif entry.type_str == "tree":
                 obj = self._get_child(tree, entry.name)
-                self._list_files_at_revision(obj, new_path, results)
+                yield from self._walk_blobs(obj, new_path)
             else:
                 raise NotImplementedError(
-                    f"object at '{new_path}' of type '{entry.name}' not supported"
+                    f"object at '{new_path}' of type '{entry.type_str}' not supported"
                 )
-        return results
+
+    def _list_files_at_revision(self, tree):
+        """
+        return paths relative to the tree for all blobs in that tree.
+        """
+        return [
+            blob_path.replace("/", os.sep) for blob_path, _ in self._walk_blobs(tree)
+        ]
+
+    def _list_blobs_at_revision(self, tree):
+        """
+        return a dictionary mapping paths relative to the tree to ids of
+        all blobs in that tree.
+        """
+        return {blob_path: entry.id.hex for blob_path, entry in self._walk_blobs(tree)}
+
+    def list_blobs_at_revision(self, commit, path):
+        """
+        for the given commit string,
+        return a dictionary mapping paths of all files that are
+        descendents of the path string to their blob ids.
+        """
+        obj = self.repo.get(commit)
+        root = self._get_object_at_path(obj, path)
+        if root is None:
+            raise GitError(
+                self.encapsulating_repo,
+                message=f"fatal: Path '{path}' does not exist in '{commit}'",
+            )
+        return self._list_blobs_at_revision(root)
 
     def list_files_at_revision(self, commit, path):
         """
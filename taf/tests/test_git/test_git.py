@@ -13,3 +13,25 @@ def test_is_branch_with_unpushed_commits(repository, clone_repository):
     (clone_repository.path / "test3.txt").write_text("Updated test3")
     clone_repository.commit(message="Update test3.txt")
     assert clone_repository.is_branch_with_unpushed_commits(branch)
+
+
+def test_get_blob(repository):
+    commit = repository.head_commit_sha()
+    assert repository._get_blob(commit, "test1.txt") == b"Some example text 1"
+    assert repository._get_blob(commit, "test3.txt") == b"Some example text 3"
+    assert repository._get_blob(commit, "missing.txt") is None
+    assert repository._get_blob(commit, "missing file.txt") is None
+    assert repository._get_blob(commit, "missing test file.txt") is None
+
+
+def test_list_blobs_at_revision(repository):
+    (repository.path / "dir" / "subdir").mkdir(parents=True)
+    (repository.path / "dir" / "test4.txt").write_text("Some example text 4")
+    (repository.path / "dir" / "subdir" / "test5.txt").write_text("Some example text 5")
+    repository.commit(message="Add dir")
+    commit = repository.head_commit_sha()
+    blobs = repository.list_blobs_at_revision(commit, "dir")
+    assert sorted(blobs) == ["subdir/test5.txt", "test4.txt"]
+    assert repository._list_blobs_at_revision(commit, "dir") == blobs
+    contents = repository._get_blobs(list(blobs.values()))
+    assert contents[blobs["subdir/test5.txt"]] == b"Some example text 5"
@@ -1,5 +1,8 @@
+import json
+import math
 import pytest
 import tempfile
+from contextlib import nullcontext
 from pathlib import Path
 
 from taf.exceptions import InvalidRepositoryError
@@ -218,6 +221,77 @@ def test_autodetect_default_branch_with_git_init_bare_expect_autodetected():
         assert default_branch in ("main", "master")
 
 
+def test_get_json_blob_with_nan():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        auth_repo = AuthenticationRepository(path=Path(temp_dir))
+        auth_repo.init_repo()
+        targets_dir = Path(temp_dir, "targets")
+        targets_dir.mkdir()
+        (targets_dir / "nan.json").write_text('{"value": NaN}')
+        (targets_dir / "invalid.json").write_text('{"value": ')
+        auth_repo.commit(message="Add targets")
+        commit = auth_repo.head_commit_sha()
+        target_blobs = auth_repo.list_blobs_at_revision(commit, "targets")
+        try:
+            nan_json = auth_repo._get_json_blob(
+                commit, "targets/nan.json", target_blobs["nan.json"]
+            )
+            assert math.isnan(nan_json["value"])
+            assert (
+                auth_repo._get_json_blob(
+                    commit, "targets/invalid.json", target_blobs["invalid.json"]
+                )
+                is None
+            )
+            assert (
+                auth_repo._get_json_blob(commit, "targets/missing.json", None) is None
+            )
+        finally:
+            auth_repo.cleanup()
+
+
+def test_targets_at_revisions_returns_independent_custom_data(monkeypatch):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        auth_repo = AuthenticationRepository(path=Path(temp_dir))
+        auth_repo.init_repo()
+        targets_dir = Path(temp_dir, "targets", "namespace")
+        targets_dir.mkdir(parents=True)
+        (targets_dir.parent / "repositories.json").write_text(
+            json.dumps({"repositories": {"namespace/repo1": {}}})
+        )
+        (targets_dir / "repo1").write_text(
+            json.dumps({"commit": "1" * 40, "nested": {"values": [1]}})
+        )
+        metadata_dir = Path(temp_dir, "metadata")
+        metadata_dir.mkdir()
+        (metadata_dir / "targets.json").write_text(
+            json.dumps({"signed": {"targets": {"namespace/repo1": {}}}})
+        )
+        auth_repo.commit(message="Add targets")
+        commit1 = auth_repo.head_commit_sha()
+        (metadata_dir / "root.json").write_text("{}")
+        auth_repo.commit(message="Add root metadata")
+        commit2 = auth_repo.head_commit_sha()
+        # roles are read from the TUF repository, which these commits do not contain
+        monkeypatch.setattr(auth_repo, "get_all_targets_roles", lambda: ["targets"])
+        monkeypatch.setattr(
+            auth_repo, "repository_at_revision", lambda _commit: nullcontext()
+        )
+        try:
+            targets = auth_repo.targets_at_revisions(commit1, commit2)
+            custom1 = targets[commit1]["namespace/repo1"]["custom"]
+            custom2 = targets[commit2]["namespace/repo1"]["custom"]
+            assert custom1 == custom2 == {"nested": {"values": [1]}}
+            custom1["nested"]["values"].append(2)
+            assert custom2 == {"nested": {"values": [1]}}
+            targets = auth_repo.targets_at_revisions(commit1)
+            assert targets[commit1]["namespace/repo1"]["custom"] == {
+                "nested": {"values": [1]}
+            }
+        finally:
+            auth_repo.cleanup()
+
+
 @pytest.mark.parametrize(
     "test_name, branch",
     [
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 from pathlib import Path
 
 import pytest
@@ -13,6 +14,10 @@ from taf.tests.yubikey_utils import VALID_PIN
 from taf.utils import to_tuf_datetime_format
 
 
+def _file_digest(path):
+    return hashlib.sha256(path.read_bytes()).digest()
+
+
 @pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Testing with real Yubikey.")
 def test_check_no_key_inserted_for_targets_should_raise_error(repositories, targets_yk):
     taf_happy_path = repositories["test-happy-path"]
@@ -40,7 +45,7 @@ def test_update_snapshot_valid_key(repositories, snapshot_key):
     interval = 1
     expected_expiration_date = to_tuf_datetime_format(start_date, interval)
     targets_metadata_path = Path(taf_happy_path.metadata_path) / "targets.json"
-    old_targets_metadata = targets_metadata_path.read_bytes()
+    old_targets_digest = _file_digest(targets_metadata_path)
     taf_happy_path.update_snapshot_keystores(
         [snapshot_key], start_date=start_date, interval=interval
     )
@@ -51,7 +56,7 @@ def test_update_snapshot_valid_key(repositories, snapshot_key):
     actual_expiration_date = signable["signed"]["expires"]
 
     # Targets data should remain the same
-    assert old_targets_metadata == targets_metadata_path.read_bytes()
+    assert old_targets_digest == _file_digest(targets_metadata_path)
     assert actual_expiration_date == expected_expiration_date
 
 
@@ -68,8 +73,8 @@ def test_update_timestamp_valid_key(repositories, timestamp_key):
     expected_expiration_date = to_tuf_datetime_format(start_date, interval)
     targets_metadata_path = Path(taf_happy_path.metadata_path) / "targets.json"
     snapshot_metadata_path = Path(taf_happy_path.metadata_path) / "snapshot.json"
-    old_targets_metadata = targets_metadata_path.read_bytes()
-    old_snapshot_metadata = snapshot_metadata_path.read_bytes()
+    old_targets_digest = _file_digest(targets_metadata_path)
+    old_snapshot_digest = _file_digest(snapshot_metadata_path)
     taf_happy_path.update_timestamp_keystores(
         [timestamp_key], start_date=start_date, interval=interval
     )
@@ -81,8 +86,8 @@ def test_update_timestamp_valid_key(repositories, timestamp_key):
 
     assert actual_expiration_date == expected_expiration_date
     # check if targets and snapshot remained the same
-    assert old_targets_metadata == targets_metadata_path.read_bytes()
-    assert old_snapshot_metadata == snapshot_metadata_path.read_bytes()
+    assert old_targets_digest == _file_digest(targets_metadata_path)
+    assert old_snapshot_digest == _file_digest(snapshot_metadata_path)
 
 
 def test_update_timestamp_wrong_key(repositories, snapshot_key):
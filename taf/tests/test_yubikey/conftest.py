@@ -3,15 +3,57 @@ from taf.tests import TEST_WITH_REAL_YK
 from taf.tests.conftest import KEYSTORE_PATH
 
 from pytest import fixture
-from taf.tests.yubikey_utils import TargetYubiKey, _yk_piv_ctrl_mock
+from taf.tests.yubikey_utils import (
+    FakeDevices,
+    Root1YubiKey,
+    TargetYubiKey,
+    _get_all_serials_mock,
+    _yk_piv_ctrl_mock,
+)
+
+# kept before they are replaced by mocks, so that device selection can be tested
+# against fake devices
+_yk_piv_ctrl = taf.yubikey._yk_piv_ctrl
+_get_all_serials = taf.yubikey.get_all_serials
 
 
 def pytest_configure(config):
     if not TEST_WITH_REAL_YK:
         taf.yubikey._yk_piv_ctrl = _yk_piv_ctrl_mock
+        taf.yubikey.get_all_serials = _get_all_serials_mock
 
 
 @fixture
 def targets_yk(pytestconfig):
     """Targets YubiKey."""
     return TargetYubiKey(KEYSTORE_PATH, pytestconfig.option.signature_scheme)
+
+
+@fixture
+def root1_yk(pytestconfig):
+    """Root1 YubiKey."""
+    return Root1YubiKey(KEYSTORE_PATH, pytestconfig.option.signature_scheme)
+
+
+@fixture
+def fake_devices(monkeypatch):
+    """Run the actual device selection of taf.yubikey against fake devices,
+    with emptied caches."""
+    devices = FakeDevices()
+    monkeypatch.setattr(taf.yubikey, "_yk_piv_ctrl", _yk_piv_ctrl)
+    monkeypatch.setattr(taf.yubikey, "get_all_serials", _get_all_serials)
+    monkeypatch.setattr(taf.yubikey, "list_all_devices", devices.list_all_devices)
+    monkeypatch.setattr(taf.yubikey, "scan_devices", devices.scan_devices)
+    monkeypatch.setattr(taf.yubikey, "read_info", devices.read_info)
+    monkeypatch.setattr(taf.yubikey, "PivSession", devices.piv_session)
+    for cache in (
+        "_devices",
+        "_pins",
+        "_pub_keys",
+        "_pub_key_pems",
+        "_certificates",
+        "_id_to_serial",
+    ):
+        monkeypatch.setattr(taf.yubikey, cache, {})
+    monkeypatch.setattr(taf.yubikey, "_devices_state", None)
+    return devices
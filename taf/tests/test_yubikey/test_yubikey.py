@@ -2,6 +2,7 @@ import pytest
 
 from taf import YubikeyMissingLibrary
 from taf.tests import TEST_WITH_REAL_YK
+from taf.tests.yubikey_utils import FakeTafRepository
 
 try:
     import taf.yubikey as yk
@@ -44,3 +45,229 @@ def test_sign_piv_rsa_pkcs1v15(targets_yk):
     signature = yk.sign_piv_rsa_pkcs1v15(message, yk.DEFAULT_PIN)
 
     assert verify_rsa_signature(signature, scheme, pub_key_pem, message) is True
+
+
+def test_sign_piv_rsa_pkcs1v15_batch(targets_yk):
+    targets_yk.insert()
+    if targets_yk.scheme == "rsassa-pss-sha256":
+        pytest.skip()
+
+    from securesystemslib.rsa_keys import verify_rsa_signature
+
+    messages = [b"First message to be signed.", b"Second message to be signed."]
+    scheme = "rsa-pkcs1v15-sha256"
+
+    pub_key_pem = yk.export_piv_pub_key().decode("utf-8")
+    signatures = yk.sign_piv_rsa_pkcs1v15_batch(messages, yk.DEFAULT_PIN)
+
+    assert len(signatures) == len(messages)
+    for signature, message in zip(signatures, messages):
+        assert verify_rsa_signature(signature, scheme, pub_key_pem, message) is True
+
+
+def test_get_piv_public_key_tuf_by_serial(targets_yk):
+    targets_yk.insert()
+    key = yk.get_piv_public_key_tuf(targets_yk.scheme, serial=targets_yk.serial)
+    assert key["keyid"] == targets_yk.tuf_key["keyid"]
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_get_serial_num_by_public_key(fake_devices, targets_yk, root1_yk):
+    fake_devices.insert(targets_yk)
+    fake_devices.insert(root1_yk)
+    targets_pem = targets_yk.tuf_key["keyval"]["public"]
+    root1_pem = root1_yk.tuf_key["keyval"]["public"]
+
+    assert yk.get_serial_num(root1_pem) == root1_yk.serial
+    assert fake_devices.list_calls == 1
+    # public keys of both YubiKeys were read while matching, so they are
+    # opened by serial number without enumerating the devices again
+    assert yk.get_serial_num(root1_pem) == root1_yk.serial
+    assert yk.get_serial_num(targets_pem) == targets_yk.serial
+    assert fake_devices.list_calls == 1
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_yubikey_signature_provider_finds_pin_by_public_key(fake_devices, targets_yk):
+    if targets_yk.scheme == "rsassa-pss-sha256":
+        pytest.skip()
+
+    from taf.repository_tool import yubikey_signature_provider
+
+    fake_devices.insert(targets_yk)
+    yk.add_key_pin(targets_yk.serial, targets_yk.pin)
+    key_id = targets_yk.tuf_key["keyid"]
+
+    signature = yubikey_signature_provider("targets", key_id, None, b"Message")
+    assert signature["keyid"] == key_id
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_export_yk_certificate_by_public_key(
+    fake_devices, targets_yk, root1_yk, tmp_path
+):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+
+    fake_devices.insert(targets_yk)
+    fake_devices.insert(root1_yk)
+    cert_path = tmp_path / f"{root1_yk.tuf_key['keyid']}.cert"
+
+    yk.export_yk_certificate(tmp_path, root1_yk.tuf_key)
+    cert_pem = cert_path.read_bytes()
+    pub_key = x509.load_pem_x509_certificate(cert_pem).public_key()
+    assert pub_key.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ) == root1_yk.pub_key.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    # the certificate was read while matching the key, so it is exported again
+    # without opening a new session
+    connections = sum(len(port.connections) for port in fake_devices.ports)
+    cert_path.unlink()
+    yk.export_yk_certificate(tmp_path, root1_yk.tuf_key)
+    assert cert_path.read_bytes() == cert_pem
+    assert sum(len(port.connections) for port in fake_devices.ports) == connections
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_sign_batch_by_serial_checks_public_key(fake_devices, targets_yk, root1_yk):
+    if targets_yk.scheme == "rsassa-pss-sha256":
+        pytest.skip()
+
+    from securesystemslib.rsa_keys import verify_rsa_signature
+
+    fake_devices.insert(targets_yk)
+    fake_devices.insert(root1_yk)
+    targets_pem = targets_yk.tuf_key["keyval"]["public"]
+    root1_pem = root1_yk.tuf_key["keyval"]["public"]
+    message = b"Message to be signed."
+
+    with pytest.raises(yk.YubikeyError):
+        yk.sign_piv_rsa_pkcs1v15_batch(
+            [message], targets_yk.pin, pub_key_pem=root1_pem, serial=targets_yk.serial
+        )
+
+    (signature,) = yk.sign_piv_rsa_pkcs1v15_batch(
+        [message], targets_yk.pin, pub_key_pem=targets_pem, serial=targets_yk.serial
+    )
+    assert verify_rsa_signature(signature, targets_yk.scheme, targets_pem, message)
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_yubikey_prompt_finds_valid_key_among_inserted(
+    fake_devices, targets_yk, root1_yk
+):
+    for yubikey in (targets_yk, root1_yk):
+        fake_devices.insert(yubikey)
+        yk.add_key_pin(yubikey.serial, yubikey.pin)
+
+    key, serial_num = yk.yubikey_prompt(
+        "root1",
+        role="root",
+        taf_repo=FakeTafRepository(root1_yk),
+        retry_on_failure=False,
+    )
+    assert serial_num == root1_yk.serial
+    assert key["keyid"] == root1_yk.tuf_key["keyid"]
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_yubikey_prompt_skips_already_loaded_keys(
+    fake_devices, targets_yk, root1_yk, capsys
+):
+    for yubikey in (targets_yk, root1_yk):
+        fake_devices.insert(yubikey)
+        yk.add_key_pin(yubikey.serial, yubikey.pin)
+    taf_repo = FakeTafRepository(targets_yk, root1_yk)
+    loaded_yubikeys = {targets_yk.serial: ["root"]}
+
+    key, serial_num = yk.yubikey_prompt(
+        "root2",
+        role="root",
+        taf_repo=taf_repo,
+        loaded_yubikeys=loaded_yubikeys,
+        retry_on_failure=False,
+    )
+    assert serial_num == root1_yk.serial
+    assert key["keyid"] == root1_yk.tuf_key["keyid"]
+    assert loaded_yubikeys == {
+        targets_yk.serial: ["root"],
+        root1_yk.serial: ["root"],
+    }
+
+    assert yk.yubikey_prompt(
+        "root3",
+        role="root",
+        taf_repo=taf_repo,
+        loaded_yubikeys=loaded_yubikeys,
+        retry_on_failure=False,
+    ) == (None, None)
+    assert "Key already loaded" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_yubikey_prompt_when_key_cannot_be_read(fake_devices, targets_yk, root1_yk):
+    for yubikey in (targets_yk, root1_yk):
+        fake_devices.insert(yubikey)
+        yk.add_key_pin(yubikey.serial, yubikey.pin)
+    fake_devices.unreadable.append(targets_yk)
+
+    # the error is ignored if another inserted key can be used
+    key, serial_num = yk.yubikey_prompt(
+        "root1",
+        role="root",
+        taf_repo=FakeTafRepository(root1_yk),
+        retry_on_failure=False,
+    )
+    assert serial_num == root1_yk.serial
+
+    # and raised if none of them can
+    with pytest.raises(yk.YubikeyError):
+        yk.yubikey_prompt(
+            "targets",
+            role="targets",
+            taf_repo=FakeTafRepository(targets_yk),
+            retry_on_failure=False,
+        )
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_open_by_serial_reuses_device_handle(fake_devices, targets_yk):
+    fake_devices.insert(targets_yk)
+    assert yk.get_all_serials() == [targets_yk.serial]
+
+    key = yk.get_piv_public_key_tuf(targets_yk.scheme, serial=targets_yk.serial)
+    assert key["keyid"] == targets_yk.tuf_key["keyid"]
+    assert fake_devices.list_calls == 1
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_open_by_serial_when_reading_device_info_fails(fake_devices, targets_yk):
+    fake_devices.insert(targets_yk)
+    yk.get_all_serials()
+    fake_devices.read_info_error = OSError("Device not responding")
+
+    key = yk.get_piv_public_key_tuf(targets_yk.scheme, serial=targets_yk.serial)
+    assert key["keyid"] == targets_yk.tuf_key["keyid"]
+    assert fake_devices.list_calls == 2
+    assert all(
+        connection.closed
+        for port in fake_devices.ports
+        for connection in port.connections
+    )
+
+
+@pytest.mark.skipif(TEST_WITH_REAL_YK, reason="Devices are simulated.")
+def test_open_by_serial_after_yubikey_replaced_in_same_port(
+    fake_devices, targets_yk, root1_yk
+):
+    fake_devices.insert(targets_yk)
+    yk.get_all_serials()
+    fake_devices.replace(targets_yk, root1_yk)
+
+    with pytest.raises(yk.YubikeyError):
+        yk.export_piv_pub_key(serial=targets_yk.serial)
+    key = yk.get_piv_public_key_tuf(root1_yk.scheme, serial=root1_yk.serial)
+    assert key["keyid"] == root1_yk.tuf_key["keyid"]
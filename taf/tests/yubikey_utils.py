@@ -154,3 +154,105 @@ def _yk_piv_ctrl_mock(serial=None, pub_key_pem=None):
         raise ValueError("No YubiKey found with the given interface(s)")
 
     yield FakePivController(INSERTED_YUBIKEY), INSERTED_YUBIKEY.serial
+
+
+def _get_all_serials_mock():
+    global INSERTED_YUBIKEY
+
+    if INSERTED_YUBIKEY is None:
+        return []
+
+    return [INSERTED_YUBIKEY.serial]
+
+
+class FakeConnection:
+    def __init__(self, yubikey):
+        self.yubikey = yubikey
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDeviceInfo:
+    def __init__(self, serial):
+        self.serial = serial
+
+
+class FakeDevice:
+    """Device handle of a USB port, which connects to whichever YubiKey is
+    currently plugged into that port, like handles returned by ykman do."""
+
+    pid = None
+
+    def __init__(self, yubikey):
+        self.yubikey = yubikey
+        self.connections = []
+
+    def open_connection(self, _connection_type):
+        connection = FakeConnection(self.yubikey)
+        self.connections.append(connection)
+        return connection
+
+
+class FakeDevices:
+    """Replaces ykman's device enumeration. Inserting or removing a YubiKey
+    changes the state returned by scan_devices, while replacing one YubiKey with
+    another in the same port does not, since it only depends on the ports."""
+
+    def __init__(self, *yubikeys):
+        self.ports = [FakeDevice(yubikey) for yubikey in yubikeys]
+        self.state = 0
+        self.list_calls = 0
+        # raised by the next read_info call, e.g. if a YubiKey stopped responding
+        self.read_info_error = None
+        # YubiKeys whose PIV application cannot be used
+        self.unreadable = []
+
+    def insert(self, yubikey):
+        self.ports.append(FakeDevice(yubikey))
+        self.state += 1
+
+    def remove(self, yubikey):
+        self.ports = [port for port in self.ports if port.yubikey is not yubikey]
+        self.state += 1
+
+    def replace(self, yubikey, new_yubikey):
+        for port in self.ports:
+            if port.yubikey is yubikey:
+                port.yubikey = new_yubikey
+
+    def list_all_devices(self):
+        self.list_calls += 1
+        return [(port, FakeDeviceInfo(port.yubikey.serial)) for port in self.ports]
+
+    def scan_devices(self):
+        return {}, self.state
+
+    def read_info(self, connection, _pid=None):
+        if self.read_info_error is not None:
+            error, self.read_info_error = self.read_info_error, None
+            raise error
+        return FakeDeviceInfo(connection.yubikey.serial)
+
+    def piv_session(self, connection):
+        if connection.yubikey in self.unreadable:
+            raise OSError("PIV application not available")
+        return FakePivController(connection.yubikey)
+
+
+class FakeTafRepository:
+    """Authentication repository in which the given YubiKeys' keys are valid keys of
+    every role"""
+
+    def __init__(self, *yubikeys):
+        self.keyids = [yubikey.tuf_key["keyid"] for yubikey in yubikeys]
+
+    def is_valid_metadata_yubikey(self, _role, public_key):
+        return public_key["keyid"] in self.keyids
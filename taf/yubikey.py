@@ -1,10 +1,10 @@
+import copy
 import datetime
 from contextlib import contextmanager
-from functools import wraps
-from collections import defaultdict
+from functools import lru_cache, wraps
 from getpass import getpass
 from pathlib import Path
-from typing import Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import click
 from cryptography import x509
@@ -14,8 +14,9 @@ from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from tuf.repository_tool import import_rsakey_from_pem
-from ykman.device import list_all_devices
+from ykman.device import list_all_devices, scan_devices
 from yubikit.core.smartcard import SmartCardConnection
+from yubikit.support import read_info
 from ykman.piv import (
     KEY_TYPE,
     MANAGEMENT_KEY_TYPE,
@@ -37,37 +38,39 @@ DEFAULT_PIN = "123456"
 DEFAULT_PUK = "12345678"
 EXPIRATION_INTERVAL = 36500
 
-_yks_data_dict: Dict = defaultdict(dict)
+_pins: Dict[int, str] = {}
+_pub_keys: Dict[int, Dict] = {}
+_pub_key_pems: Dict[int, str] = {}
+_certificates: Dict[int, x509.Certificate] = {}
+_id_to_serial: Dict[str, int] = {}
+# device handles of YubiKeys found by the last enumeration, by serial number, and
+# the state of attached devices at that time, used to tell if they are still valid
+_devices: Dict[int, Any] = {}
+_devices_state: Optional[int] = None
 
 
-def add_key_id_mapping(serial_num: str, keyid: str) -> None:
-    if "ids" not in _yks_data_dict:
-        _yks_data_dict["ids"] = defaultdict(dict)
-    _yks_data_dict["ids"][keyid] = serial_num
+def add_key_id_mapping(serial_num: int, keyid: str) -> None:
+    _id_to_serial[keyid] = serial_num
 
 
-def add_key_pin(serial_num: str, pin: str) -> None:
-    _yks_data_dict[serial_num]["pin"] = pin
+def add_key_pin(serial_num: int, pin: str) -> None:
+    _pins[serial_num] = pin
 
 
-def add_key_public_key(serial_num: str, public_key: Dict) -> None:
-    _yks_data_dict[serial_num]["public_key"] = public_key
+def add_key_public_key(serial_num: int, public_key: Dict) -> None:
+    _pub_keys[serial_num] = public_key
 
 
 def get_key_pin(serial_num: int) -> Optional[str]:
-    if serial_num in _yks_data_dict:
-        return _yks_data_dict.get(serial_num, {}).get("pin")
-    return None
+    return _pins.get(serial_num)
 
 
-def get_key_serial_by_id(keyid: str) -> Optional[str]:
-    return _yks_data_dict.get("ids", {}).get(keyid)
+def get_key_serial_by_id(keyid: str) -> Optional[int]:
+    return _id_to_serial.get(keyid)
 
 
-def get_key_public_key(serial_num: str) -> Optional[Dict]:
-    if serial_num in _yks_data_dict:
-        return _yks_data_dict.get(serial_num, {}).get("public_key")
-    return None
+def get_key_public_key(serial_num: int) -> Optional[Dict]:
+    return _pub_keys.get(serial_num)
 
 
 def raise_yubikey_err(msg: Optional[str] = None) -> Callable:
@@ -93,13 +96,97 @@ def raise_yubikey_err(msg: Optional[str] = None) -> Callable:
     return wrapper
 
 
+def _pub_key_pem_matches(device_pub_key_pem: str, pub_key_pem: str) -> bool:
+    # Tries to match without last newline char
+    return device_pub_key_pem == pub_key_pem or device_pub_key_pem[:-1] == pub_key_pem
+
+
+def _get_serial_by_pub_key_pem(pub_key_pem: str) -> Optional[int]:
+    for serial_num, device_pub_key_pem in _pub_key_pems.items():
+        if _pub_key_pem_matches(device_pub_key_pem, pub_key_pem):
+            return serial_num
+    return None
+
+
+def _read_certificate(session, serial_num: int) -> x509.Certificate:
+    """Read the certificate stored in the signature slot and remember it, together
+    with its public key, so that it can be reused without opening a new session
+    """
+    cert = session.get_certificate(SLOT.SIGNATURE)
+    _certificates[serial_num] = cert
+    _pub_key_pems[serial_num] = (
+        cert.public_key()
+        .public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode("utf-8")
+    )
+    return cert
+
+
+@lru_cache(maxsize=16)
+def _import_rsakey_from_pem(pub_key_pem: str, scheme: str) -> Dict:
+    """Parse public key PEM into TUF's key format only once per key and scheme.
+    The returned dictionary is shared, so it should be copied before being handed out
+    """
+    return import_rsakey_from_pem(pub_key_pem, scheme)
+
+
+def _list_devices():
+    """Connect to all inserted YubiKeys and read their info, remembering their
+    device handles so that they can be opened again without another enumeration
+    """
+    global _devices_state
+
+    # scan before listing, so that a YubiKey inserted in the meantime changes the state
+    _, state = scan_devices()
+    devices = list_all_devices()
+    _devices.clear()
+    # device info of keys which could not be fully read might not have a serial
+    _devices.update(
+        (info.serial, dev)
+        for dev, info in devices
+        if getattr(info, "serial", None) is not None
+    )
+    _devices_state = state
+    return devices
+
+
+def _open_connection(serial=None):
+    """Open a smart card connection, which is needed for PIV, to the inserted YubiKey
+    with the given serial number, or to the first inserted YubiKey if serial number
+    is not specified. Return a tuple of Nones if no such YubiKey is inserted.
+    """
+    # scan_devices does not connect to the devices, so it is much cheaper than
+    # listing them again, and its state changes when a YubiKey is inserted or removed
+    if serial in _devices and scan_devices()[1] == _devices_state:
+        dev = _devices[serial]
+        connection = dev.open_connection(SmartCardConnection)
+        # the state does not include serial numbers, so it stays the same if a
+        # YubiKey is replaced by one of the same model in the same port
+        try:
+            if read_info(connection, dev.pid).serial == serial:
+                return connection, serial
+        except Exception:
+            # e.g. if the YubiKey was removed after scanning, enumerate them again
+            pass
+        connection.close()
+    for dev, info in _list_devices():
+        if serial is None or info.serial == serial:
+            return dev.open_connection(SmartCardConnection), info.serial
+    return None, None
+
+
 @contextmanager
 def _yk_piv_ctrl(serial=None, pub_key_pem=None):
     """Context manager to open connection and instantiate Piv Session.
 
     Args:
+        - serial(int): Serial number of the Yubikey to open a session with
         - pub_key_pem(str): Match Yubikey's public key (PEM) if multiple keys
-                            are inserted
+                            are inserted. If serial number is given as well,
+                            the Yubikey with that serial number must match it
 
     Returns:
         - ykman.piv.PivSession
@@ -107,37 +194,46 @@ def _yk_piv_ctrl(serial=None, pub_key_pem=None):
     Raises:
         - YubikeyError
     """
-    # If pub_key_pem is given, iterate all devices, read x509 certs and try to match
-    # public keys.
-    if pub_key_pem is not None:
-        for dev, info in list_all_devices():
-            # Connect to a YubiKey over a SmartCardConnection, which is needed for PIV.
+    if pub_key_pem is not None and serial is None:
+        # If a YubiKey's certificate already matched the public key, try only that
+        # YubiKey instead of opening a session with every inserted device. Its
+        # certificate is read again, since the key could have been replaced
+        cached_serial = _get_serial_by_pub_key_pem(pub_key_pem)
+        if cached_serial is not None:
+            connection, _ = _open_connection(cached_serial)
+            if connection is not None:
+                with connection:
+                    session = PivSession(connection)
+                    _read_certificate(session, cached_serial)
+                    if _pub_key_pem_matches(_pub_key_pems[cached_serial], pub_key_pem):
+                        yield session, cached_serial
+                        return
+
+        # The YubiKey is not inserted anymore or does not hold the key, so iterate
+        # all devices, read x509 certs and try to match public keys.
+        for dev, info in _list_devices():
             with dev.open_connection(SmartCardConnection) as connection:
                 session = PivSession(connection)
-                device_pub_key_pem = (
-                    session.get_certificate(SLOT.SIGNATURE)
-                    .public_key()
-                    .public_bytes(
-                        encoding=serialization.Encoding.PEM,
-                        format=serialization.PublicFormat.SubjectPublicKeyInfo,
-                    )
-                    .decode("utf-8")
-                )
-                # Tries to match without last newline char
-                if (
-                    device_pub_key_pem == pub_key_pem
-                    or device_pub_key_pem[:-1] == pub_key_pem
-                ):
-                    break
-                yield session, info.serial
-    else:
-        for dev, info in list_all_devices():
-            if serial is None or info.serial == serial:
-                with dev.open_connection(SmartCardConnection) as connection:
-                    session = PivSession(connection)
+                _read_certificate(session, info.serial)
+                if _pub_key_pem_matches(_pub_key_pems[info.serial], pub_key_pem):
                     yield session, info.serial
-            else:
-                pass
+                    return
+        raise YubikeyError("None of the inserted YubiKeys matches the public key")
+
+    connection, serial = _open_connection(serial)
+    if connection is None:
+        raise YubikeyError("YubiKey not inserted")
+    with connection:
+        session = PivSession(connection)
+        if pub_key_pem is not None:
+            # the YubiKey was selected by its serial number, so check that it holds
+            # the given key instead of using whichever key it holds
+            _read_certificate(session, serial)
+            if not _pub_key_pem_matches(_pub_key_pems[serial], pub_key_pem):
+                raise YubikeyError(
+                    f"YubiKey with serial {serial} does not match the public key"
+                )
+        yield session, serial
 
 
 def is_inserted():
@@ -152,15 +248,20 @@ def is_inserted():
     Raises:
         - YubikeyError
     """
-    return len(list(list_all_devices())) > 0
+    # scan_devices only counts attached YubiKeys, without connecting to them
+    # and reading their info like list_all_devices does
+    devices, _ = scan_devices()
+    return any(count > 0 for count in devices.values())
 
 
 @raise_yubikey_err()
-def is_valid_pin(pin):
+def is_valid_pin(pin, serial=None):
     """Checks if given pin is valid.
 
     Args:
         pin(str): Yubikey piv PIN
+        serial(int): Serial number of the Yubikey to check, if multiple keys
+                     are inserted
 
     Returns:
         tuple: True if PIN is valid, otherwise False, number of PIN retries
@@ -168,7 +269,7 @@ def is_valid_pin(pin):
     Raises:
         - YubikeyError
     """
-    with _yk_piv_ctrl() as (ctrl, _):
+    with _yk_piv_ctrl(serial=serial) as (ctrl, _):
         try:
             ctrl.verify_pin(pin)
             return True, None  # ctrl.get_pin_tries() fails if PIN is valid
@@ -194,6 +295,24 @@ def get_serial_num(pub_key_pem=None):
         return serial
 
 
+@raise_yubikey_err("Cannot get serial numbers.")
+def get_all_serials() -> List[int]:
+    """Get serial numbers of all inserted Yubikeys, without opening PIV sessions.
+    Found devices are remembered, so that a PIV session with one of them can then
+    be opened without enumerating them again.
+
+    Returns:
+        List of Yubikey serial numbers
+
+    Raises:
+        - YubikeyError
+    """
+    _list_devices()
+    # devices are remembered by serial number in the order they were listed,
+    # skipping the ones which do not report a serial number
+    return list(_devices)
+
+
 @raise_yubikey_err("Cannot export x509 certificate.")
 def export_piv_x509(cert_format=serialization.Encoding.PEM, pub_key_pem=None):
     """Exports YubiKey's piv slot x509.
@@ -209,19 +328,22 @@ def export_piv_x509(cert_format=serialization.Encoding.PEM, pub_key_pem=None):
     Raises:
         - YubikeyError
     """
-    with _yk_piv_ctrl(pub_key_pem=pub_key_pem) as (ctrl, _):
-        x509 = ctrl.get_certificate(SLOT.SIGNATURE)
+    with _yk_piv_ctrl(pub_key_pem=pub_key_pem) as (ctrl, serial_num):
+        x509 = _read_certificate(ctrl, serial_num)
         return x509.public_bytes(encoding=cert_format)
 
 
 @raise_yubikey_err("Cannot export public key.")
-def export_piv_pub_key(pub_key_format=serialization.Encoding.PEM, pub_key_pem=None):
+def export_piv_pub_key(
+    pub_key_format=serialization.Encoding.PEM, pub_key_pem=None, serial=None
+):
     """Exports YubiKey's piv slot public key.
 
     Args:
         - pub_key_format(str): One of 'serialization.Encoding' formats.
         - pub_key_pem(str): Match Yubikey's public key (PEM) if multiple keys
                             are inserted
+        - serial(int): Serial number of the Yubikey, if multiple keys are inserted
 
     Returns:
         PIV public key in a given format (bytes)
@@ -229,8 +351,8 @@ def export_piv_pub_key(pub_key_format=serialization.Encoding.PEM, pub_key_pem=No
     Raises:
         - YubikeyError
     """
-    with _yk_piv_ctrl(pub_key_pem=pub_key_pem) as (ctrl, _):
-        x509 = ctrl.get_certificate(SLOT.SIGNATURE)
+    with _yk_piv_ctrl(serial=serial, pub_key_pem=pub_key_pem) as (ctrl, serial_num):
+        x509 = _read_certificate(ctrl, serial_num)
         return x509.public_key().public_bytes(
             encoding=pub_key_format,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
@@ -246,18 +368,30 @@ def export_yk_certificate(certs_dir, key):
     certs_dir.mkdir(parents=True, exist_ok=True)
     cert_path = certs_dir / f"{key['keyid']}.cert"
     print(f"Exporting certificate to {cert_path}")
+    # reuse the certificate if it was already read from the YubiKey holding the key
+    pub_key_pem = key["keyval"]["public"]
+    serial_num = _get_serial_by_pub_key_pem(pub_key_pem)
+    if serial_num is not None and serial_num in _certificates:
+        cert = _certificates[serial_num].public_bytes(
+            encoding=serialization.Encoding.PEM
+        )
+    else:
+        cert = export_piv_x509(pub_key_pem=pub_key_pem)
     with open(cert_path, "wb") as f:
-        f.write(export_piv_x509())
+        f.write(cert)
 
 
 @raise_yubikey_err("Cannot get public key in TUF format.")
-def get_piv_public_key_tuf(scheme=DEFAULT_RSA_SIGNATURE_SCHEME, pub_key_pem=None):
+def get_piv_public_key_tuf(
+    scheme=DEFAULT_RSA_SIGNATURE_SCHEME, pub_key_pem=None, serial=None
+):
     """Return public key from a Yubikey in TUF's RSAKEY_SCHEMA format.
 
     Args:
         - scheme(str): Rsa signature scheme (default is rsa-pkcs1v15-sha256)
         - pub_key_pem(str): Match Yubikey's public key (PEM) if multiple keys
                             are inserted
+        - serial(int): Serial number of the Yubikey, if multiple keys are inserted
 
     Returns:
         A dictionary containing the RSA keys and other identifying information
@@ -267,8 +401,12 @@ def get_piv_public_key_tuf(scheme=DEFAULT_RSA_SIGNATURE_SCHEME, pub_key_pem=None
     Raises:
         - YubikeyError
     """
-    pub_key_pem = export_piv_pub_key(pub_key_pem=pub_key_pem).decode("utf-8")
-    return import_rsakey_from_pem(pub_key_pem, scheme)
+    # always read from the YubiKey, since its key could have been replaced
+    # by a different process, while parsing the same PEM is cached
+    pub_key_pem = export_piv_pub_key(pub_key_pem=pub_key_pem, serial=serial).decode(
+        "utf-8"
+    )
+    return copy.deepcopy(_import_rsakey_from_pem(pub_key_pem, scheme))
 
 
 @raise_yubikey_err("Cannot sign data.")
@@ -294,6 +432,39 @@ def sign_piv_rsa_pkcs1v15(data, pin, pub_key_pem=None):
         )
 
 
+@raise_yubikey_err("Cannot sign data.")
+def sign_piv_rsa_pkcs1v15_batch(data_list, pin, pub_key_pem=None, serial=None):
+    """Sign multiple data with key from YubiKey's piv slot, verifying the pin
+    only once.
+
+    Args:
+        - data_list(list): Data (bytes) to be signed
+        - pin(str): Pin for piv slot login.
+        - pub_key_pem(str): Match Yubikey's public key (PEM) if multiple keys
+                            are inserted
+        - serial(int): Serial number of the Yubikey, if multiple keys are inserted.
+                       If pub_key_pem is given as well, the Yubikey must match it
+
+    Returns:
+        List of signatures (bytes), in the same order as data_list
+
+    Raises:
+        - YubikeyError
+    """
+    with _yk_piv_ctrl(serial=serial, pub_key_pem=pub_key_pem) as (ctrl, _):
+        ctrl.verify_pin(pin)
+        return [
+            ctrl.sign(
+                SLOT.SIGNATURE,
+                KEY_TYPE.RSA2048,
+                data,
+                hashes.SHA256(),
+                padding.PKCS1v15(),
+            )
+            for data in data_list
+        ]
+
+
 @raise_yubikey_err("Cannot setup Yubikey.")
 def setup(
     pin,
@@ -301,7 +472,8 @@ def setup(
     cert_exp_days=365,
     pin_retries=10,
     private_key_pem=None,
-    mgm_key=generate_random_management_key(MANAGEMENT_KEY_TYPE.TDES),
+    mgm_key=None,
+    serial=None,
 ):
     """Use to setup inserted Yubikey, with following steps (order is important):
       - reset to factory settings
@@ -318,7 +490,10 @@ def setup(
         - pin_retries(int): Number of retries for PIN
         - private_key_pem(str): Private key in PEM format. If given, it will be
                                 imported to Yubikey.
-        - mgm_key(bytes): New management key
+        - mgm_key(bytes): New management key. A random one is generated if not
+                          given.
+        - serial(int): Serial number of the Yubikey to setup, if multiple keys
+                       are inserted
 
     Returns:
         PIV public key in PEM format (bytes)
@@ -326,7 +501,13 @@ def setup(
     Raises:
         - YubikeyError
     """
-    with _yk_piv_ctrl() as (ctrl, _):
+    if mgm_key is None:
+        mgm_key = generate_random_management_key(MANAGEMENT_KEY_TYPE.TDES)
+
+    with _yk_piv_ctrl(serial=serial) as (ctrl, serial_num):
+        # the key is about to be replaced
+        _pub_key_pems.pop(serial_num, None)
+        _certificates.pop(serial_num, None)
         # Factory reset and set PINs
         ctrl.reset()
 
@@ -386,17 +567,19 @@ def setup_new_yubikey(serial_num, scheme=DEFAULT_RSA_SIGNATURE_SCHEME):
     pin = get_key_pin(serial_num)
     cert_cn = input("Enter key holder's name: ")
     print("Generating key, please wait...")
-    pub_key_pem = setup(pin, cert_cn, cert_exp_days=EXPIRATION_INTERVAL).decode("utf-8")
+    pub_key_pem = setup(
+        pin, cert_cn, cert_exp_days=EXPIRATION_INTERVAL, serial=serial_num
+    ).decode("utf-8")
     scheme = DEFAULT_RSA_SIGNATURE_SCHEME
-    key = import_rsakey_from_pem(pub_key_pem, scheme)
+    key = copy.deepcopy(_import_rsakey_from_pem(pub_key_pem, scheme))
     return key
 
 
-def get_and_validate_pin(key_name, pin_confirm=True, pin_repeat=True):
+def get_and_validate_pin(key_name, pin_confirm=True, pin_repeat=True, serial=None):
     valid_pin = False
     while not valid_pin:
         pin = get_pin_for(key_name, pin_confirm, pin_repeat)
-        valid_pin, retries = is_valid_pin(pin)
+        valid_pin, retries = is_valid_pin(pin, serial)
         if not valid_pin and not retries:
             raise InvalidPINError("No retries left. YubiKey locked.")
         if not valid_pin:
@@ -407,6 +590,43 @@ def get_and_validate_pin(key_name, pin_confirm=True, pin_repeat=True):
     return pin
 
 
+def _find_valid_yubikey(
+    serial_nums: List[int],
+    role: Optional[str],
+    taf_repo: Any,
+    registering_new_key: bool,
+    creating_new_key: bool,
+) -> Tuple[Optional[int], Optional[Dict]]:
+    """Return serial number and public key of the first of the given Yubikeys which
+    can be used as the provided role's key, or a tuple of Nones. If reading the
+    public key of one of them failed and none of the others can be used, the error
+    is raised.
+    """
+    read_error = None
+    for serial_num in serial_nums:
+        # read the public key, unless a new key needs to be generated on the yubikey
+        try:
+            public_key = (
+                None if creating_new_key else get_piv_public_key_tuf(serial=serial_num)
+            )
+        except YubikeyError as e:
+            read_error = e
+            continue
+        # check if this yubikey is can be used for signing the provided role's metadata
+        # if the key was already registered as that role's key
+        if (
+            registering_new_key
+            or role is None
+            or taf_repo is None
+            or taf_repo.is_valid_metadata_yubikey(role, public_key)
+        ):
+            return serial_num, public_key
+        print(f"The inserted YubiKey is not a valid {role} key")
+    if read_error is not None:
+        raise read_error
+    return None, None
+
+
 def yubikey_prompt(
     key_name,
     role=None,
@@ -421,17 +641,17 @@ def yubikey_prompt(
     hide_already_loaded_message=False,
 ):
     def _read_and_check_yubikey(
-        key_name,
-        role,
-        taf_repo,
-        registering_new_key,
-        creating_new_key,
-        loaded_yubikeys,
-        pin_confirm,
-        pin_repeat,
-        prompt_message,
-        retrying,
-    ):
+        key_name: str,
+        role: Optional[str],
+        taf_repo: Any,
+        registering_new_key: bool,
+        creating_new_key: bool,
+        loaded_yubikeys: Optional[Dict[int, List[str]]],
+        pin_confirm: bool,
+        pin_repeat: bool,
+        prompt_message: Optional[str],
+        retrying: bool,
+    ) -> Tuple[bool, Optional[Dict], Optional[int]]:
 
         if retrying:
             if prompt_message is None:
@@ -439,36 +659,39 @@ def yubikey_prompt(
             input(prompt_message)
         # make sure that YubiKey is inserted
         try:
-            serial_num = get_serial_num()
-        except Exception:
+            serial_nums = get_all_serials()
+        except YubikeyError:
+            serial_nums = []
+        if not serial_nums:
             print("YubiKey not inserted")
             return False, None, None
 
-        # check if this key is already loaded as the provided role's key (we can use the same key
+        # skip keys which are already loaded as the provided role's key (we can use the same key
         # to sign different metadata)
-        if (
-            loaded_yubikeys is not None
-            and serial_num in loaded_yubikeys
-            and role in loaded_yubikeys[serial_num]
-        ):
+        serial_nums_to_check = [
+            serial_num
+            for serial_num in serial_nums
+            if loaded_yubikeys is None
+            or role not in loaded_yubikeys.get(serial_num, [])
+        ]
+        if not serial_nums_to_check:
             if not hide_already_loaded_message:
                 print("Key already loaded")
             return False, None, None
 
-        # read the public key, unless a new key needs to be generated on the yubikey
-        public_key = get_piv_public_key_tuf() if not creating_new_key else None
-        # check if this yubikey is can be used for signing the provided role's metadata
-        # if the key was already registered as that role's key
-        if not registering_new_key and role is not None and taf_repo is not None:
-            if not taf_repo.is_valid_metadata_yubikey(role, public_key):
-                print(f"The inserted YubiKey is not a valid {role} key")
-                return False, None, None
+        serial_num, public_key = _find_valid_yubikey(
+            serial_nums_to_check, role, taf_repo, registering_new_key, creating_new_key
+        )
+        if serial_num is None:
+            return False, None, None
 
         if get_key_pin(serial_num) is None:
             if creating_new_key:
                 pin = get_pin_for(key_name, pin_confirm, pin_repeat)
             else:
-                pin = get_and_validate_pin(key_name, pin_confirm, pin_repeat)
+                pin = get_and_validate_pin(
+                    key_name, pin_confirm, pin_repeat, serial_num
+                )
             add_key_pin(serial_num, pin)
 
         if get_key_public_key(serial_num) is None and public_key is not None: